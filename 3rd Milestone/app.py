@@ -1,252 +1,743 @@
-from datetime import datetime
-import requests
-import json
-import time
-from collections import deque
-from typing import List, Generator
-import streamlit as st
-
-# -------------------------------
-# Config
-# -------------------------------
-OLLAMA_BASE_URL = "http://localhost:11434"
-MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
-MAX_CONTEXT_LENGTH = 4000
-RATE_LIMIT_REQUESTS = 15
-RATE_LIMIT_WINDOW = 120  # seconds
-
-
-def initialize_session_state():
-    defaults = {
-        "messages": [],
-        "pdf_text": {},
-        "pdf_name": None,
-        "selected_model": "gemma3:1b",
-        "temperature": 0.7,
-        "top_p": 0.9,
-        "top_k": 40,
-        "max_tokens": 2000,
-        "session_timestamp": datetime.now().isoformat(),
-        "rate_limiter": RateLimiter(),
-        "chat_sessions": {},
-        "current_session": "default",
-        "model_loaded": False
-    }
-    for k, v in defaults.items():
-        if k not in st.session_state:
-            st.session_state[k] = v
-
-
-# -------------------------------
-# Rate Limiter
-# -------------------------------
-class RateLimiter:
-    def __init__(self, max_requests: int = RATE_LIMIT_REQUESTS, window: int = RATE_LIMIT_WINDOW):
-        self.requests = deque()
-        self.max_requests = max_requests
-        self.window = window
-
-    def allow_request(self) -> bool:
-        now = time.time()
-        while self.requests and self.requests[0] < now - self.window:
-            self.requests.popleft()
-        if len(self.requests) < self.max_requests:
-            self.requests.append(now)
-            return True
-        return False
-
-    def get_wait_time(self) -> float:
-        if not self.requests or len(self.requests) < self.max_requests:
-            return 0.0
-        return max(0.0, self.requests[0] + self.window - time.time())
-
-
-# -------------------------------
-# Ollama PDF Chatbot
-# -------------------------------
-class OllamaPDFChatbot:
-    def __init__(self, base_url: str = OLLAMA_BASE_URL):
-        self.base_url = base_url
-        self.session = requests.Session()
-
-    # Health check
-    def check_connection(self) -> bool:
-        try:
-            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except Exception:
-            return False
-
-    # Get available models
-    def get_available_models(self) -> List[str]:
-        endpoints = ["/api/tags", "/api/models", "/api/list"]
-        for ep in endpoints:
-            try:
-                response = self.session.get(f"{self.base_url}{ep}", timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    return self._parse_models(data)
-            except Exception:
-                continue
-        return []
-
-    def _parse_models(self, data) -> List[str]:
-        if isinstance(data, list):
-            return [str(m) for m in data if m]
-        if isinstance(data, dict):
-            if "models" in data:
-                models = data["models"]
-                return [m.get("name") or m.get("model") for m in models if isinstance(m, dict)]
-            return list(data.keys())
-        return []
-
-    # -------------------------------
-    # Streaming response with retry
-    # -------------------------------
-    def stream_response(
-        self,
-        prompt: str,
-        context: str = "",
-        system_prompt: str = "",
-        retries: int = 3,
-        wait: int = 10
-    ) -> Generator[str, None, None]:
-        if not prompt.strip():
-            yield "❌ Please enter a valid question."
-            return
-
-        if len(prompt) > 5000:
-            yield "❌ Question too long. Keep under 5000 chars."
-            return
-
-        if not st.session_state.rate_limiter.allow_request():
-            wait_time = st.session_state.rate_limiter.get_wait_time()
-            yield f"⏳ Rate limit exceeded. Wait {wait_time:.1f}s."
-            return
-
-        payload = {
-            "model": st.session_state.selected_model,
-            "prompt": self._build_prompt(prompt, context, system_prompt),
-            "stream": True,
-            "options": {
-                "temperature": st.session_state.temperature,
-                "top_p": st.session_state.top_p,
-                "top_k": st.session_state.top_k,
-                "num_predict": st.session_state.max_tokens,
-            }
-        }
-        if system_prompt:
-            payload["system"] = system_prompt
-
-        for attempt in range(retries):
-            try:
-                with self.session.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    stream=True,
-                    timeout=180
-                ) as response:
-                    if response.status_code != 200:
-                        yield f"❌ Error {response.status_code}: {response.text[:500]}"
-                        return
-
-                    full_response = ""
-                    for raw_line in response.iter_lines(decode_unicode=True):
-                        if not raw_line:
-                            continue
-                        try:
-                            json_line = json.loads(raw_line.strip())
-                            if "response" in json_line:
-                                token = json_line["response"]
-                                full_response += token
-                                yield token
-                            if "error" in json_line:
-                                yield f"\n❌ Error: {json_line['error']}"
-                                break
-                        except Exception:
-                            continue
-                    return  # ✅ Success, exit after one attempt
-            except requests.exceptions.Timeout:
-                if attempt < retries - 1:
-                    yield f"⏳ Timeout, retrying in {wait}s... (attempt {attempt+1}/{retries})"
-                    time.sleep(wait)
-                else:
-                    yield "⏳ Request timeout. The model may be loading or unavailable."
-            except requests.exceptions.ConnectionError:
-                yield "❌ Could not connect to Ollama. Run `ollama serve`."
-                return
-            except Exception as e:
-                yield f"❌ Unexpected error: {str(e)}"
-                return
-
-    # -------------------------------
-    # Non-streaming response with retry
-    # -------------------------------
-    def get_response(
-        self,
-        prompt: str,
-        context: str = "",
-        system_prompt: str = "",
-        retries: int = 3,
-        wait: int = 10
-    ) -> str:
-        if not prompt.strip():
-            return "❌ Please enter a valid question."
-
-        if len(prompt) > 5000:
-            return "❌ Question too long. Keep under 5000 chars."
-
-        if not st.session_state.rate_limiter.allow_request():
-            wait_time = st.session_state.rate_limiter.get_wait_time()
-            return f"⏳ Rate limit exceeded. Wait {wait_time:.1f}s."
-
-        payload = {
-            "model": st.session_state.selected_model,
-            "prompt": self._build_prompt(prompt, context, system_prompt),
-            "stream": False,
-            "options": {
-                "temperature": st.session_state.temperature,
-                "top_p": st.session_state.top_p,
-                "top_k": st.session_state.top_k,
-                "num_predict": st.session_state.max_tokens,
-            }
-        }
-
-        for attempt in range(retries):
-            try:
-                response = self.session.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    timeout=120
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    return data.get("response", "No response generated.")
-                else:
-                    return f"❌ Error {response.status_code}: Could not get response from Ollama."
-            except requests.exceptions.Timeout:
-                if attempt < retries - 1:
-                    time.sleep(wait)
-                    continue
-                return "⏳ Request timeout. The model may be loading or unavailable."
-            except requests.exceptions.ConnectionError:
-                return "❌ Could not connect to Ollama. Please make sure `ollama serve` is running."
-            except Exception as e:
-                return f"❌ Unexpected error: {str(e)}"
-
-    # -------------------------------
-    # Prompt builder
-    # -------------------------------
-    def _build_prompt(self, prompt: str, context: str, system_prompt: str) -> str:
-        base_system = (
-            "You are a helpful AI assistant that answers based on document content. "
-            "Be precise, factual, and cite page numbers if available."
-        )
-        parts = []
-        if context:
-            parts.append(f"DOCUMENT CONTEXT:\n{context[:10000]}")
-        if system_prompt:
-            parts.append(f"SYSTEM PROMPT:\n{system_prompt}")
-        parts.append(f"QUESTION:\n{prompt}")
-        parts.append(f"INSTRUCTIONS:\n{base_system}")
-        return "\n\n".join(parts)
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import json
+import copy
+import time
+import hashlib
+import random
+import socket
+import threading
+from collections import OrderedDict
+from typing import List, Generator, Iterator, Optional, Tuple, Union
+import streamlit as st
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:  # orjson is optional; stdlib json also accepts bytes
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+try:
+    import tiktoken
+except ImportError:  # not a requirement; the UTF-8 byte estimate is the default
+    tiktoken = None
+
+# -------------------------------
+# Config
+# -------------------------------
+OLLAMA_BASE_URL = "http://localhost:11434"
+MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+MAX_CONTEXT_LENGTH = 4000
+MODELS_CACHE_TTL = 60  # seconds
+HEALTH_CACHE_TTL = 10  # seconds
+PDF_CACHE_ENTRIES = 8
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.3  # hotter sampling is too random to reuse
+RATE_LIMIT_REQUESTS = 15
+RATE_LIMIT_WINDOW = 120  # seconds
+RETRY_MAX_WAIT = 40  # seconds
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 32
+SESSION_HEADERS = {"Connection": "keep-alive", "Accept-Encoding": "identity"}
+SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+STREAM_CHUNK_SIZE = 4096
+STREAM_FLUSH_INTERVAL = 0.04  # seconds
+STREAM_FLUSH_TOKENS = 8
+PROMPT_CONTEXT_CHARS = 10000
+APPROX_MAX_TOKENS = 6000
+CHARS_PER_TOKEN = 4
+JSON_HEADERS = {"Content-Type": "application/json"}
+STREAM_HEADERS = {**JSON_HEADERS, "Accept": "application/x-ndjson"}
+
+BASE_SYSTEM = (
+    "You are a helpful AI assistant that answers based on document content. "
+    "Be precise, factual, and cite page numbers if available."
+)
+_CTX_HDR = "DOCUMENT CONTEXT:\n"
+_SYS_HDR = "SYSTEM PROMPT:\n"
+_Q_HDR = "QUESTION:\n"
+_INSTR_HDR = "INSTRUCTIONS:\n"
+_SECTION_SEP = "\n\n"
+_INSTR_TAIL = _SECTION_SEP + _INSTR_HDR + BASE_SYSTEM
+
+
+_STATIC_DEFAULTS = {
+    "messages": [],
+    "pdf_hash": None,
+    "pdf_name": None,
+    "selected_model": "gemma3:1b",
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "top_k": 40,
+    "max_tokens": 2000,
+    "chat_sessions": {},
+    "current_session": "default",
+    "model_loaded": False
+}
+
+
+def initialize_session_state():
+    for k, v in _STATIC_DEFAULTS.items():
+        if k not in st.session_state:
+            # Copy so sessions never share the same list/dict default
+            st.session_state[k] = copy.copy(v)
+    # Built only when missing, not on every rerun
+    if "session_timestamp" not in st.session_state:
+        st.session_state.session_timestamp = datetime.now().isoformat()
+    if "rate_limiter" not in st.session_state:
+        st.session_state.rate_limiter = RateLimiter()
+
+
+# -------------------------------
+# PDF text
+# -------------------------------
+def extract_pdf_text(file_bytes: bytes) -> dict:
+    if fitz is None:
+        raise RuntimeError("PyMuPDF is required to read PDFs. Run `pip install pymupdf`.")
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        return {page.number + 1: page.get_text() for page in doc}
+
+
+@st.cache_resource(max_entries=PDF_CACHE_ENTRIES)
+def get_pdf_text(file_hash: str, _file_bytes: bytes) -> dict:
+    # Keyed on the hash only; the leading underscore keeps Streamlit from hashing the bytes
+    return extract_pdf_text(_file_bytes)
+
+
+def load_pdf(uploaded_file) -> Optional[dict]:
+    file_bytes = uploaded_file.getvalue()
+    if len(file_bytes) > MAX_FILE_SIZE:
+        st.error(f"❌ File too large. Max {MAX_FILE_SIZE // (1024 * 1024)}MB.")
+        return None
+    file_hash = hashlib.sha1(file_bytes).hexdigest()
+    try:
+        pdf_text = get_pdf_text(file_hash, file_bytes)
+    except Exception as e:
+        st.error(f"❌ Could not read PDF: {str(e)}")
+        return None
+    # Only remember the document once its text is actually available
+    st.session_state.pdf_hash = file_hash
+    st.session_state.pdf_name = uploaded_file.name
+    return pdf_text
+
+
+# -------------------------------
+# Rate Limiter
+# -------------------------------
+class RateLimiter:
+    """Weighted two-bucket sliding window: O(1) time and memory per call."""
+
+    def __init__(self, max_requests: int = RATE_LIMIT_REQUESTS, window: int = RATE_LIMIT_WINDOW):
+        self.max_requests = max_requests
+        self.window = window
+        self.window_start: float = time.time()
+        self.prev: int = 0
+        self.curr: int = 0
+
+    def _roll(self, now: float) -> float:
+        elapsed = now - self.window_start
+        if elapsed >= self.window:
+            # Buckets stay aligned to window boundaries; skip every whole window passed
+            passed = elapsed // self.window
+            # A gap of two or more windows leaves nothing to carry over
+            self.prev = self.curr if passed == 1 else 0
+            self.curr = 0
+            self.window_start += self.window * passed
+            elapsed -= self.window * passed
+        return elapsed
+
+    def allow_request(self) -> bool:
+        elapsed = self._roll(time.time())
+        weight = 1 - elapsed / self.window
+        if self.prev * weight + self.curr < self.max_requests:
+            self.curr += 1
+            return True
+        return False
+
+    def get_wait_time(self) -> float:
+        # Time until prev * (1 - t / window) + curr drops to max_requests; any
+        # request made after that moment passes the strict check in allow_request
+        elapsed = self._roll(time.time())
+        free = self.max_requests - self.curr
+        if free > 0:
+            if self.prev * (1 - elapsed / self.window) < free:
+                return 0.0
+            # prev * (1 - t / window) = free  =>  t = window * (1 - free / prev)
+            return max(0.0, self.window * (1 - free / self.prev) - elapsed)
+        # Current bucket is full: wait for the next boundary, then for it to decay as prev
+        return (self.window - elapsed) + self.window * (1 - self.max_requests / self.curr)
+
+
+# -------------------------------
+# Prompt assembly
+# -------------------------------
+def _assemble_prompt(prompt: str, context: str, system_prompt: str) -> str:
+    parts = []
+    if context:
+        parts += (_CTX_HDR, context, _SECTION_SEP)
+    if system_prompt:
+        parts += (_SYS_HDR, system_prompt, _SECTION_SEP)
+    parts += (_Q_HDR, prompt, _INSTR_TAIL)
+    return "".join(parts)
+
+
+# -------------------------------
+# Prompt size estimate
+# -------------------------------
+@st.cache_resource(show_spinner=False)
+def _token_encoder():
+    # Cached for the server's lifetime, failures included: get_encoding() may fetch the
+    # BPE file over the network, and offline users must not retry that per question
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def approx_tokens(text: str) -> int:
+    # Anything this long is over budget by any estimate; skip encoding it
+    if len(text) > APPROX_MAX_TOKENS * CHARS_PER_TOKEN:
+        return APPROX_MAX_TOKENS + 1
+    encoder = _token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    # UTF-8 bytes track token counts far better than code points for CJK/emoji
+    return len(text.encode("utf-8")) // CHARS_PER_TOKEN
+
+
+# -------------------------------
+# NDJSON stream reader
+# -------------------------------
+def _iter_ndjson_lines(response) -> Iterator[bytes]:
+    # Split raw bytes on newlines ourselves instead of decoding line by line
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=False):
+        if not chunk:
+            continue
+        buf.extend(chunk)
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            if line:
+                yield line
+    if buf.strip():
+        yield buf
+
+
+def _parse_frame(line: bytes) -> Tuple[Optional[str], Optional[str]]:
+    # Guard against non-generate lines only; every real Ollama frame, including the
+    # final done frame ("response": ""), carries "response" and is parsed
+    if b'"response"' not in line and b'"error"' not in line:
+        return None, None
+    try:
+        frame = _json_loads(line)
+    except Exception:
+        return None, None
+    if not isinstance(frame, dict):
+        return None, None
+    return frame.get("response"), frame.get("error")
+
+
+# -------------------------------
+# Partial JSON repair
+# -------------------------------
+class _JsonStreamRepair:
+    """Closes a JSON object the model is still writing so it parses mid-stream.
+
+    Only objects are tracked: a bare "[2, 5]" in prose is usually a page citation.
+    Nothing is emitted until the first key is followed by ":", so braces in prose
+    never surface as a document.
+    """
+
+    _CLOSERS = {"{": "}", "[": "]"}
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self.parts: List[str] = []
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.escape = False
+        self.stack: List[str] = []
+        self.last = ""  # last significant char outside strings
+        self.committed = False  # seen a key/value ":", so this is not prose
+        self.size = 0  # chars consumed into parts
+        self.key_start: Optional[int] = None  # doc offset of a key still missing its ":"
+        self.last_valid: Optional[str] = None
+
+    def feed(self, text: str) -> Optional[str]:
+        """Consume a chunk; return the repaired document if it changed, else None."""
+        if self.done:
+            return None
+        while True:
+            start = 0
+            if not self.started:
+                start = text.find("{")
+                if start < 0:
+                    return None  # still in prose before the JSON starts
+                self.started = True
+
+            end = self._scan(text, start)
+            self.parts.append(text[start:end])
+            self.size += end - start
+            if not self.done:
+                return self._repair()
+
+            doc = "".join(self.parts)
+            try:
+                _json_loads(doc)
+            except Exception:
+                # Prose braces such as "{page 3}"; rescan just past that opener
+                rest = doc[1:] + text[end:]
+                self._reset()
+                text = rest
+                continue
+            if doc == self.last_valid:
+                return None
+            self.last_valid = doc
+            return doc
+
+    def _scan(self, text: str, start: int) -> int:
+        # Advance the string/bracket state; returns where the document closed, if it did
+        for i in range(start, len(text)):
+            ch = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self.last = ch
+            elif ch == '"':
+                self.in_string = True
+                if self.last in "{," and self.stack and self.stack[-1] == "}":
+                    self.key_start = self.size + i - start
+            elif ch in self._CLOSERS:
+                self.stack.append(self._CLOSERS[ch])
+                self.last = ch
+            elif ch == ":":
+                self.committed = True
+                self.key_start = None
+                self.last = ch
+            elif ch in "}]":
+                if self.stack:
+                    self.stack.pop()
+                self.last = ch
+                if not self.stack:
+                    self.done = True
+                    return i + 1
+            elif not ch.isspace():
+                self.last = ch
+        return len(text)
+
+    def _repair(self) -> Optional[str]:
+        if not self.committed:
+            return None
+        doc = "".join(self.parts)
+        tail = ""
+        if self.key_start is not None:
+            # Cut inside a key, or a key without its ":" yet; drop that member
+            doc = doc[:self.key_start].rstrip()
+            if doc.endswith(","):
+                doc = doc[:-1]
+        elif self.in_string:
+            if self.escape:
+                doc = doc[:-1]
+            tail = '"'
+        elif self.last == ",":
+            doc = doc.rstrip()[:-1]
+        elif self.last == ":":
+            tail = "null"
+        candidate = doc + tail + "".join(reversed(self.stack))
+        if candidate == self.last_valid:
+            return None
+        try:
+            _json_loads(candidate)
+        except Exception:
+            return None  # e.g. cut inside a key or literal; keep the last good one
+        self.last_valid = candidate
+        return candidate
+
+
+# -------------------------------
+# Retry backoff
+# -------------------------------
+def _backoff_delay(wait: float, attempt: int) -> float:
+    # Jittered exponential backoff: [wait, 2*wait] on the first retry, doubling up to the
+    # cap, so concurrent clients never retry in lockstep
+    return random.uniform(wait, max(wait, min(RETRY_MAX_WAIT, wait * 2 ** (attempt + 1))))
+
+
+# -------------------------------
+# Token batching for UI flushes
+# -------------------------------
+class _TokenBatcher:
+    """Groups streamed tokens so the UI re-renders per batch, not per token."""
+
+    def __init__(self):
+        self.buf: List[str] = []
+        self.last_flush = time.monotonic()
+        self.emitted = False
+
+    def add(self, token: str) -> Optional[str]:
+        self.buf.append(token)
+        # The first token goes out at once so batching never delays time-to-first-token
+        if (
+            not self.emitted
+            or len(self.buf) >= STREAM_FLUSH_TOKENS
+            or time.monotonic() - self.last_flush > STREAM_FLUSH_INTERVAL
+        ):
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        self.last_flush = time.monotonic()
+        if not self.buf:
+            return None
+        text = "".join(self.buf)
+        self.buf.clear()
+        self.emitted = True
+        return text
+
+
+# -------------------------------
+# Cached Ollama server queries
+# -------------------------------
+@st.cache_data(ttl=HEALTH_CACHE_TTL)
+def ollama_alive(base_url: str, _session: requests.Session) -> bool:
+    # _session is the chatbot's pooled Session; the underscore keeps it out of the cache key
+    try:
+        response = _session.get(f"{base_url}/api/tags", timeout=5)
+        return response.status_code == 200
+    except Exception:
+        return False
+
+
+@st.cache_data(ttl=MODELS_CACHE_TTL)
+def list_models(base_url: str, _session: requests.Session) -> List[str]:
+    endpoints = ["/api/tags", "/api/models", "/api/list"]
+    for ep in endpoints:
+        try:
+            response = _session.get(f"{base_url}{ep}", timeout=10)
+            if response.status_code == 200:
+                data = response.json()
+                return _parse_models(data)
+        except Exception:
+            continue
+    return []
+
+
+def _parse_models(data) -> List[str]:
+    # Fast path for the usual /api/tags shape: {"models": [{"name": ...}, ...]}
+    if isinstance(data, dict):
+        if "models" not in data:
+            return list(data.keys())
+        models = data["models"]
+        if not isinstance(models, list):
+            return []  # e.g. {"models": null}; not a model called "models"
+        names = []
+        for m in models:
+            if isinstance(m, dict):
+                name = m.get("name") or m.get("model")
+                if name:
+                    names.append(name)
+        return names
+    if isinstance(data, list):
+        return [m if isinstance(m, str) else str(m) for m in data if m]
+    return []
+
+
+def refresh_models_button() -> None:
+    # Sidebar control to drop the cached model list on demand
+    if st.sidebar.button("🔄 Refresh models"):
+        list_models.clear()
+        ollama_alive.clear()
+
+
+# -------------------------------
+# HTTP adapter
+# -------------------------------
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled sockets disable Nagle and enable TCP keep-alive."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault("socket_options", SOCKET_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+
+
+# -------------------------------
+# Ollama PDF Chatbot
+# -------------------------------
+class OllamaPDFChatbot:
+    def __init__(self, base_url: str = OLLAMA_BASE_URL):
+        self.base_url = base_url
+        self.session = requests.Session()
+        # Token streams arrive in tiny chunks, so gzip would only add latency
+        self.session.headers.update(SESSION_HEADERS)
+        # Retries are handled by the callers, so urllib3 must not retry on its own
+        adapter = _KeepAliveAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_MAXSIZE,
+            max_retries=Retry(total=0)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._responses: "OrderedDict[str, str]" = OrderedDict()
+        self._responses_lock = threading.Lock()
+
+    # Keep-alive warm-up so the first question skips TCP setup
+    def warm_up(self) -> None:
+        try:
+            self.session.head(f"{self.base_url}/api/tags", timeout=5)
+        except Exception:
+            pass
+
+    # Health check
+    def check_connection(self) -> bool:
+        return ollama_alive(self.base_url, self.session)
+
+    # Get available models
+    def get_available_models(self) -> List[str]:
+        return list_models(self.base_url, self.session)
+
+    # -------------------------------
+    # Streaming response with retry
+    # -------------------------------
+    def stream_response(
+        self,
+        prompt: str,
+        context: str = "",
+        system_prompt: str = "",
+        retries: int = 3,
+        wait: int = 10,
+        parse_inner_json: bool = False
+    ) -> Generator[Union[str, Tuple[str, str]], None, None]:
+        events = self._stream_events(prompt, context, system_prompt, retries, wait)
+        if not parse_inner_json:
+            for _, text in events:
+                yield text
+            return
+
+        # Yield ("text", chunk) / ("status", notice), plus ("json_partial", doc) whenever
+        # the model's JSON grows
+        repair = _JsonStreamRepair()
+        for kind, text in events:
+            yield kind, text
+            if kind == "status":
+                # Retries restart generation, so drop whatever JSON we had
+                repair = _JsonStreamRepair()
+                continue
+            partial = repair.feed(text)
+            if partial is not None:
+                yield "json_partial", partial
+
+    def _stream_events(
+        self,
+        prompt: str,
+        context: str,
+        system_prompt: str,
+        retries: int,
+        wait: int
+    ) -> Generator[Tuple[str, str], None, None]:
+        # ("text", chunk) for model output, ("status", message) for notices and errors
+        body, error = self._prepare_request(prompt, context, system_prompt, stream=True)
+        if error:
+            yield "status", error
+            return
+
+        for attempt in range(retries):
+            try:
+                with self.session.post(
+                    f"{self.base_url}/api/generate",
+                    data=body,
+                    headers=STREAM_HEADERS,
+                    stream=True,
+                    timeout=180
+                ) as response:
+                    if response.status_code != 200:
+                        yield "status", f"❌ Error {response.status_code}: {response.text[:500]}"
+                        return
+
+                    batch = _TokenBatcher()
+                    for raw_line in _iter_ndjson_lines(response):
+                        token, error = _parse_frame(raw_line)
+                        if token:
+                            text = batch.add(token)
+                            if text:
+                                yield "text", text
+                        if error is not None:
+                            text = batch.flush()
+                            if text:
+                                yield "text", text
+                            yield "status", f"\n❌ Error: {error}"
+                            break
+                    text = batch.flush()
+                    if text:
+                        yield "text", text
+                    return  # ✅ Success, exit after one attempt
+            except requests.exceptions.Timeout:
+                if attempt < retries - 1:
+                    delay = _backoff_delay(wait, attempt)
+                    yield "status", f"⏳ Timeout, retrying in {delay:.0f}s... (attempt {attempt+1}/{retries})"
+                    time.sleep(delay)
+                else:
+                    yield "status", "⏳ Request timeout. The model may be loading or unavailable."
+            except requests.exceptions.ConnectionError:
+                yield "status", "❌ Could not connect to Ollama. Run `ollama serve`."
+                return
+            except Exception as e:
+                yield "status", f"❌ Unexpected error: {str(e)}"
+                return
+
+    # -------------------------------
+    # Non-streaming response with retry
+    # -------------------------------
+    def get_response(
+        self,
+        prompt: str,
+        context: str = "",
+        system_prompt: str = "",
+        retries: int = 3,
+        wait: int = 10
+    ) -> str:
+        key = self._response_cache_key(prompt, context, system_prompt)
+        cached = self._cached_response(key)
+        if cached is not None:
+            return cached
+
+        body, error = self._prepare_request(prompt, context, system_prompt, stream=False)
+        if error:
+            return error
+
+        for attempt in range(retries):
+            try:
+                response = self.session.post(
+                    f"{self.base_url}/api/generate",
+                    data=body,
+                    headers=JSON_HEADERS,
+                    timeout=120
+                )
+                if response.status_code == 200:
+                    data = response.json()
+                    if "response" not in data:
+                        return "No response generated."
+                    self._remember_response(key, data["response"])
+                    return data["response"]
+                else:
+                    return f"❌ Error {response.status_code}: Could not get response from Ollama."
+            except requests.exceptions.Timeout:
+                if attempt < retries - 1:
+                    time.sleep(_backoff_delay(wait, attempt))
+                    continue
+                return "⏳ Request timeout. The model may be loading or unavailable."
+            except requests.exceptions.ConnectionError:
+                return "❌ Could not connect to Ollama. Please make sure `ollama serve` is running."
+            except Exception as e:
+                return f"❌ Unexpected error: {str(e)}"
+
+    # -------------------------------
+    # Response cache
+    # -------------------------------
+    def _response_cache_key(self, prompt: str, context: str, system_prompt: str) -> Optional[str]:
+        ss = st.session_state
+        if ss.temperature > RESPONSE_CACHE_MAX_TEMPERATURE:
+            return None
+        raw = (
+            f"{ss.selected_model}|{ss.temperature}|{ss.top_p}|{ss.top_k}|{ss.max_tokens}|"
+            f"{context[:PROMPT_CONTEXT_CHARS]}|{system_prompt}|{prompt}"
+        )
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def _cached_response(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        with self._responses_lock:
+            text = self._responses.get(key)
+            if text is not None:
+                self._responses.move_to_end(key)
+            return text
+
+    def _remember_response(self, key: Optional[str], text: str) -> None:
+        if key is None:
+            return
+        with self._responses_lock:
+            self._responses[key] = text
+            self._responses.move_to_end(key)
+            if len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+
+    # -------------------------------
+    # Request validation and payload
+    # -------------------------------
+    def _prepare_request(
+        self,
+        prompt: str,
+        context: str,
+        system_prompt: str,
+        stream: bool
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        # Single place for validation, rate limiting and serialization; returns (body, error)
+        if not prompt.strip():
+            return None, "❌ Please enter a valid question."
+
+        if approx_tokens(prompt) > APPROX_MAX_TOKENS:
+            return None, f"❌ Question too long. Keep under ~{APPROX_MAX_TOKENS} tokens."
+
+        if not st.session_state.rate_limiter.allow_request():
+            wait_time = st.session_state.rate_limiter.get_wait_time()
+            return None, f"⏳ Rate limit exceeded. Wait {wait_time:.1f}s."
+
+        return _json_dumps(self._build_payload(prompt, context, system_prompt, stream)), None
+
+    def _build_payload(self, prompt: str, context: str, system_prompt: str, stream: bool) -> dict:
+        payload = {
+            "model": st.session_state.selected_model,
+            "prompt": self._build_prompt(prompt, context, system_prompt),
+            "stream": stream,
+            "options": {
+                "temperature": st.session_state.temperature,
+                "top_p": st.session_state.top_p,
+                "top_k": st.session_state.top_k,
+                "num_predict": st.session_state.max_tokens,
+            }
+        }
+        # Streaming requests have always passed the system prompt natively too
+        if stream and system_prompt:
+            payload["system"] = system_prompt
+        return payload
+
+    # -------------------------------
+    # Prompt builder
+    # -------------------------------
+    def _build_prompt(self, prompt: str, context: str, system_prompt: str) -> str:
+        # Slicing a str that already fits returns the same object, so no copy
+        return _assemble_prompt(prompt, context[:PROMPT_CONTEXT_CHARS], system_prompt)
+
+
+# -------------------------------
+# Shared chatbot instance
+# -------------------------------
+@st.cache_resource
+def get_chatbot(base_url: str = OLLAMA_BASE_URL) -> OllamaPDFChatbot:
+    # One chatbot (and its Session pool) per server URL for the lifetime of the server
+    chatbot = OllamaPDFChatbot(base_url)
+    chatbot.warm_up()
+    return chatbot
@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("requests")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app  # noqa: E402
+
+
+def feed_all(chunks):
+    repair = app._JsonStreamRepair()
+    emitted = [repair.feed(chunk) for chunk in chunks]
+    return [doc for doc in emitted if doc is not None]
+
+
+CASES = [
+    # (name, stream text, last document surfaced)
+    ("valid_citation_before_object", 'Answer (see pages [2, 5]): {"page": 3}', '{"page": 3}'),
+    ("invalid_prose_brackets", 'See [page 3] for details. {"page": 3}', '{"page": 3}'),
+    ("prose_braces", 'Use {curly} braces, then {"a": 1}', '{"a": 1}'),
+    ("escapes", '{"note": "say \\"hi\\" \\\\ ok"}', '{"note": "say \\"hi\\" \\\\ ok"}'),
+    ("cut_inside_key", '{"pages": [1], "no', '{"pages": [1]}'),
+    ("key_without_colon", '{"pages": [1], "note"', '{"pages": [1]}'),
+    ("trailing_comma", '{"a": 1,', '{"a": 1}'),
+    ("dangling_colon", '{"a":', '{"a":null}'),
+    ("nested_partial", '{"a": {"b": [1, 2', '{"a": {"b": [1, 2]}}'),
+    ("code_fence", '```json\n{"a": [1, 2]}\n```', '{"a": [1, 2]}'),
+    ("cut_inside_escape", '{"a": "x\\', '{"a": "x"}'),
+]
+
+
+@pytest.mark.parametrize("name,text,expected", CASES, ids=[c[0] for c in CASES])
+@pytest.mark.parametrize("chunking", ["per_char", "single_chunk"])
+def test_repair_surfaces_expected_document(name, text, expected, chunking):
+    chunks = list(text) if chunking == "per_char" else [text]
+    emitted = feed_all(chunks)
+
+    assert emitted, "no document surfaced"
+    assert emitted[-1] == expected
+    for doc in emitted:
+        assert isinstance(json.loads(doc), dict), f"prose surfaced as {doc!r}"
+
+
+def test_nothing_surfaces_from_prose_only():
+    assert feed_all(list("See [2, 5] and {page 3} for details.")) == []
+
+
+def test_closed_document_ignores_later_text():
+    repair = app._JsonStreamRepair()
+    assert repair.feed('{"a": 1}') == '{"a": 1}'
+    assert repair.feed(' and later {"b": 2}') is None
+
+
+def test_unchanged_document_is_not_emitted_twice():
+    repair = app._JsonStreamRepair()
+    assert repair.feed('{"a": "x') == '{"a": "x"}'
+    # A pending escape repairs to the same document
+    assert repair.feed("\\") is None
@@ -0,0 +1,89 @@
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("requests")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(app.time, "time", fake)
+    return fake
+
+
+def test_wait_time_matches_allow_request_after_burst(clock):
+    limiter = app.RateLimiter(max_requests=15, window=120)
+    assert all(limiter.allow_request() for _ in range(15))
+
+    clock.now += 44
+    assert not limiter.allow_request()
+    wait = limiter.get_wait_time()
+    assert wait > 0
+
+    clock.now += wait - 0.01
+    assert not limiter.allow_request()
+    assert limiter.get_wait_time() > 0
+
+    clock.now += 0.02
+    assert limiter.allow_request()
+
+
+def test_no_denial_with_zero_wait_after_boundary(clock):
+    limiter = app.RateLimiter(max_requests=15, window=120)
+    for _ in range(15):
+        limiter.allow_request()
+
+    # Estimate is 15 * (1 - 0.5 / 120) ~= 14.94, just under the limit
+    clock.now += 120.5
+    assert limiter.get_wait_time() == 0.0
+    assert limiter.allow_request()
+
+    # Now over the limit: the denial must come with a real wait
+    assert not limiter.allow_request()
+    wait = limiter.get_wait_time()
+    assert wait > 0
+    clock.now += wait + 0.01
+    assert limiter.allow_request()
+
+
+def test_long_idle_gap_resets_both_buckets(clock):
+    limiter = app.RateLimiter(max_requests=3, window=10)
+    for _ in range(3):
+        limiter.allow_request()
+
+    clock.now += 25
+    assert limiter.get_wait_time() == 0.0
+    assert all(limiter.allow_request() for _ in range(3))
+
+
+def test_wait_time_is_exact_under_random_traffic(clock):
+    rng = random.Random(1234)
+    for _ in range(200):
+        limiter = app.RateLimiter(max_requests=rng.randint(1, 20), window=rng.choice([10, 60, 120]))
+        clock.now = 1000.0
+        for _ in range(rng.randint(0, 60)):
+            clock.now += rng.uniform(0, limiter.window / 4)
+            limiter.allow_request()
+
+        wait = limiter.get_wait_time()
+        start = clock.now
+        if wait > 0.01:
+            clock.now = start + wait - 0.005
+            assert not limiter.allow_request()
+        clock.now = start + wait + 0.005
+        assert limiter.allow_request()